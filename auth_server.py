@@ -1,14 +1,18 @@
 from __future__ import annotations
 
+import asyncio
 import os
-import secrets
+import re
 from pathlib import Path
 from typing import Optional, List
 from urllib.parse import urlparse
 from datetime import datetime, timezone
 
+import aiohttp
+import orjson
+from pymongo.errors import PyMongoError
 from sanic import Sanic
-from sanic.response import json, redirect, html
+from sanic.response import json, redirect, html, raw
 from sanic.exceptions import SanicException
 from sanic.log import logger
 from dotenv import load_dotenv
@@ -16,79 +20,123 @@ from dotenv import load_dotenv
 from funcs.connectDB import connect_to_mongodb
 from funcs.auth_store import (
     create_auth_indexes,
+    make_token,
     save_oauth_state,
     consume_oauth_state,
-    upsert_discord_user,
-    new_session,
+    complete_login,
     get_user_by_session,
     delete_session,
 )
-from funcs.discord_oauth import build_authorize_url, exchange_code_for_token, fetch_discord_user
+from funcs.discord_oauth import (
+    build_authorize_url,
+    exchange_code_for_token,
+    fetch_discord_user,
+    get_session,
+    close_session,
+)
 
 
 load_dotenv()
 
-app = Sanic("AuthLedd")
+# orjson serializes every json() response; Sanic accepts bytes from dumps
+app = Sanic("AuthLedd", dumps=orjson.dumps)
+
+# Environment is fixed per process, so read it once at import
+DISCORD_CLIENT_ID = os.getenv("DISCORD_CLIENT_ID")
+DISCORD_CLIENT_SECRET = os.getenv("DISCORD_CLIENT_SECRET")
+DISCORD_REDIRECT_URI = os.getenv("DISCORD_REDIRECT_URI")
+DISCORD_SCOPE = os.getenv("DISCORD_SCOPE", "identify")
+
+# Shared-session cookie (name must match main.py). Use a parent domain so
+# auth.ledd.live and ledd.live share the cookie.
+COOKIE_NAME = os.getenv("AUTH_COOKIE_NAME", "ledd_auth")
+COOKIE_DOMAIN = os.getenv("AUTH_COOKIE_DOMAIN", ".ledd.live")
+COOKIE_SECURE = os.getenv("AUTH_COOKIE_SECURE", "true").lower() == "true"
+COOKIE_SAMESITE = os.getenv("AUTH_COOKIE_SAMESITE", "Lax")
+COOKIE_OPTS = {
+    "domain": COOKIE_DOMAIN,
+    "secure": COOKIE_SECURE,
+    "httponly": True,
+    "samesite": COOKIE_SAMESITE,
+    "path": "/",
+}
+
+# /ping never changes, so serialize it once
+_PING_BODY = orjson.dumps({"status": "ok"})
+
+# HTTP cache policies: health checks may be briefly cached, per-user data never
+_PING_HEADERS = {"Cache-Control": "public, max-age=5"}
+_NO_STORE_HEADERS = {"Cache-Control": "private, no-store"}
+
+# Expiry used to clear the session cookie on logout
+_EXPIRED = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+AUTH_ALLOWED_RETURN_HOSTS_RAW = os.getenv("AUTH_ALLOWED_RETURN_HOSTS", "ledd.live")
+ALLOWED_RETURN_HOSTS: List[str] = [h.strip().lower() for h in AUTH_ALLOWED_RETURN_HOSTS_RAW.split(",") if h.strip()]
+# Exact-match set plus ".host" suffixes for a single str.endswith(tuple) call
+_ALLOWED_EXACT = frozenset(ALLOWED_RETURN_HOSTS)
+_ALLOWED_SUFFIXES = tuple("." + h for h in ALLOWED_RETURN_HOSTS)
 
 
 @app.listener("before_server_start")
 async def setup_db(app: Sanic, _loop):
-    client, db = connect_to_mongodb()
+    client, db = await connect_to_mongodb()
+    # Always bound (None when unavailable) so handlers can read app.ctx.db directly
+    app.ctx.db = db
     if db is not None:
-        create_auth_indexes(db)
-        app.ctx.db = db
+        # Build missing indexes in the background so the worker starts serving immediately
+        app.add_task(create_auth_indexes(db))
         app.ctx.client = client
         app.ctx.db_ready = True
     else:
         app.ctx.db_ready = False
 
 
+@app.listener("before_server_start")
+async def setup_http(_app: Sanic, _loop):
+    # Build the shared Discord HTTP session inside the worker's event loop
+    get_session()
+
+
+@app.listener("before_server_stop")
+async def close_http(_app: Sanic, _loop):
+    await close_session()
+
+
 def _require_db():
-    db = getattr(app.ctx, "db", None)
+    db = app.ctx.db
     if db is None:
         raise SanicException("Database not available", status_code=503)
     return db
 
 
-def _cookie_settings():
-    # Use a parent domain so auth.ledd.live and ledd.live share the cookie
-    domain = os.getenv("AUTH_COOKIE_DOMAIN", ".ledd.live")
-    secure = os.getenv("AUTH_COOKIE_SECURE", "true").lower() == "true"
-    samesite = os.getenv("AUTH_COOKIE_SAMESITE", "Lax")
-    return {
-        "domain": domain,
-        "secure": secure,
-        "httponly": True,
-        "samesite": samesite,
-        "path": "/",
-    }
-
-
 def _get_redirect_uri(request) -> str:
     # Prefer explicit env var, fallback to infer from request
-    env_redirect = os.getenv("DISCORD_REDIRECT_URI")
-    if env_redirect:
-        return env_redirect
+    if DISCORD_REDIRECT_URI:
+        return DISCORD_REDIRECT_URI
     scheme = "https" if request.headers.get("x-forwarded-proto", request.scheme) == "https" else "http"
     host = request.headers.get("x-forwarded-host", request.host)
     return f"{scheme}://{host}/discord/callback"
 
 
-def _allowed_return_hosts() -> List[str]:
-    raw = os.getenv("AUTH_ALLOWED_RETURN_HOSTS", "ledd.live")
-    return [h.strip().lower() for h in raw.split(",") if h.strip()]
+# Fast path for plain http(s)://host[:port]/... URLs; anything with userinfo,
+# backslashes or other oddities falls through to urlparse.
+_URL_RE = re.compile(r"^(https?)://([^/:?#@\\\s]+)(?::\d+)?(?:[/?#]|$)")
+
+
+def _is_allowed_host(host: str) -> bool:
+    return host in _ALLOWED_EXACT or host.endswith(_ALLOWED_SUFFIXES)
 
 
 def _is_allowed_redirect_url(url: str) -> bool:
+    m = _URL_RE.match(url)
+    if m:
+        return _is_allowed_host(m.group(2).lower())
     try:
         p = urlparse(url)
         if not p.scheme or not p.netloc:
             return False
-        host = p.netloc.split(":")[0].lower()
-        for allowed in _allowed_return_hosts():
-            if host == allowed or host.endswith("." + allowed):
-                return True
-        return False
+        return _is_allowed_host(p.netloc.split(":")[0].lower())
     except Exception:
         return False
 
@@ -97,22 +145,22 @@ def _pick_continue_url(request) -> str:
     # Priority: explicit ?continue= -> X-Continue header -> Referer -> default
     provided = request.args.get("continue") or request.headers.get("x-continue") or request.headers.get("referer")
     if not provided:
-        return f"https://{_allowed_return_hosts()[0]}/me"
+        return f"https://{ALLOWED_RETURN_HOSTS[0]}/me"
 
     # Allow relative path by mapping to apex host
     if provided.startswith("/") and not provided.startswith("//"):
-        return f"https://{_allowed_return_hosts()[0]}{provided}"
+        return f"https://{ALLOWED_RETURN_HOSTS[0]}{provided}"
 
     # Only allow absolute HTTP(S) URLs within allowed hosts
     if _is_allowed_redirect_url(provided):
         return provided
 
-    return f"https://{_allowed_return_hosts()[0]}/me"
+    return f"https://{ALLOWED_RETURN_HOSTS[0]}/me"
 
 
-@app.get("/ping")
+@app.route("/ping", methods=["GET", "HEAD"])
 async def ping(_request):
-    return json({"status": "ok"})
+    return raw(_PING_BODY, content_type="application/json", headers=_PING_HEADERS)
 
 
 
@@ -125,21 +173,18 @@ async def index(request):
 async def discord_login(request):
     db = _require_db()
 
-    client_id = os.getenv("DISCORD_CLIENT_ID")
-    client_secret = os.getenv("DISCORD_CLIENT_SECRET")
-    if not client_id or not client_secret:
+    if not DISCORD_CLIENT_ID or not DISCORD_CLIENT_SECRET:
         return json({"error": "DISCORD_CLIENT_ID/SECRET not configured"}, status=500)
 
     # Determine where to send the user after successful login
     continue_to = _pick_continue_url(request)
 
     # CSRF state
-    state = secrets.token_urlsafe(24)
-    save_oauth_state(db, state, continue_to)
+    state = make_token(24)
+    await save_oauth_state(db, state, continue_to)
 
     redirect_uri = _get_redirect_uri(request)
-    scope = os.getenv("DISCORD_SCOPE", "identify")
-    url = build_authorize_url(client_id=client_id, state=state, redirect_uri=redirect_uri, scope=scope)
+    url = build_authorize_url(client_id=DISCORD_CLIENT_ID, state=state, redirect_uri=redirect_uri, scope=DISCORD_SCOPE)
     return redirect(url)
 
 
@@ -147,9 +192,7 @@ async def discord_login(request):
 async def discord_callback(request):
     db = _require_db()
 
-    client_id = os.getenv("DISCORD_CLIENT_ID")
-    client_secret = os.getenv("DISCORD_CLIENT_SECRET")
-    if not client_id or not client_secret:
+    if not DISCORD_CLIENT_ID or not DISCORD_CLIENT_SECRET:
         return json({"error": "DISCORD_CLIENT_ID/SECRET not configured"}, status=500)
 
     code = request.args.get("code")
@@ -161,22 +204,33 @@ async def discord_callback(request):
     if not code or not state:
         return json({"error": "Missing code or state"}, status=400)
 
-    state_doc = consume_oauth_state(db, state)
+    state_doc = await consume_oauth_state(db, state)
     if not state_doc:
         return json({"error": "Invalid or expired state"}, status=400)
 
     redirect_uri = _get_redirect_uri(request)
 
+    # Discord rejections (RuntimeError) and network hiccups are expected: log them
+    # without a stack trace. Anything else propagates to Sanic's error handler.
     try:
         token = await exchange_code_for_token(
             code=code,
-            client_id=client_id,
-            client_secret=client_secret,
+            client_id=DISCORD_CLIENT_ID,
+            client_secret=DISCORD_CLIENT_SECRET,
             redirect_uri=redirect_uri,
         )
+    except (aiohttp.ClientError, asyncio.TimeoutError, RuntimeError) as e:
+        logger.warning("Discord token exchange failed: %s", e)
+        return json({"error": "OAuth flow failed"}, status=500)
+
+    try:
         userinfo = await fetch_discord_user(token["access_token"])  # type: ignore[index]
+    except (aiohttp.ClientError, asyncio.TimeoutError, KeyError, RuntimeError) as e:
+        logger.warning("Discord user fetch failed: %s", e)
+        return json({"error": "OAuth flow failed"}, status=500)
 
-        user_doc = upsert_discord_user(
+    try:
+        _user_doc, session_id = await complete_login(
             db,
             discord_user=userinfo,
             token_info={
@@ -187,29 +241,23 @@ async def discord_callback(request):
                 "token_type": token.get("token_type"),
             },
         )
-
-        session_id = new_session(db, user_doc["discord_id"])  # type: ignore[index]
-
-        # Set cookie
-        cookie_name = os.getenv("AUTH_COOKIE_NAME", "ledd_auth")
-        cookie_opts = _cookie_settings()
-
-        # Validate stored continue URL before redirecting
-        stored = state_doc.get("continue")
-        continue_url = (
-            stored if (isinstance(stored, str) and _is_allowed_redirect_url(stored)) else _pick_continue_url(request)
-        )
-        response = redirect(continue_url)
-        response.add_cookie(cookie_name, session_id, **cookie_opts)
-        return response
-    except Exception as e:
-        logger.exception("Discord callback failed: %s", e)
+    except PyMongoError:
+        logger.exception("Storing Discord login failed")
         return json({"error": "OAuth flow failed"}, status=500)
 
+    # Validate stored continue URL before redirecting
+    stored = state_doc.get("continue")
+    continue_url = (
+        stored if (isinstance(stored, str) and _is_allowed_redirect_url(stored)) else _pick_continue_url(request)
+    )
+    response = redirect(continue_url)
+    # Set cookie
+    response.add_cookie(COOKIE_NAME, session_id, **COOKIE_OPTS)
+    return response
+
 
 def _extract_session_id(request) -> Optional[str]:
-    cookie_name = os.getenv("AUTH_COOKIE_NAME", "ledd_auth")
-    return request.cookies.get(cookie_name)
+    return request.cookies.get(COOKIE_NAME)
 
 
 @app.get("/me")
@@ -217,10 +265,10 @@ async def me(request):
     db = _require_db()
     session_id = _extract_session_id(request)
     if not session_id:
-        return json({"error": "Not authenticated"}, status=401)
-    user = get_user_by_session(db, session_id)
+        return json({"error": "Not authenticated"}, status=401, headers=_NO_STORE_HEADERS)
+    user = await get_user_by_session(db, session_id)
     if not user:
-        return json({"error": "Invalid session"}, status=401)
+        return json({"error": "Invalid session"}, status=401, headers=_NO_STORE_HEADERS)
     # Minimal public profile
     return json(
         {
@@ -228,49 +276,44 @@ async def me(request):
             "username": user.get("username"),
             "global_name": user.get("global_name"),
             "avatar": user.get("avatar"),
-        }
+        },
+        headers=_NO_STORE_HEADERS,
     )
 
 
 @app.post("/logout")
 async def logout(request):
-    db = _require_db()
     session_id = _extract_session_id(request)
+    # Only touch the database when there is a session to delete
     if session_id:
-        delete_session(db, session_id)
-    cookie_name = os.getenv("AUTH_COOKIE_NAME", "ledd_auth")
-    cookie_opts = _cookie_settings()
+        await delete_session(_require_db(), session_id)
     # Choose redirect or JSON based on client intent
     continue_to = request.args.get("continue") or request.headers.get("referer")
     wants_html = "text/html" in (request.headers.get("accept", "").lower())
     if continue_to and isinstance(continue_to, str) and _is_allowed_redirect_url(continue_to):
         response = redirect(continue_to)
     elif wants_html:
-        response = redirect(f"https://{_allowed_return_hosts()[0]}/")
+        response = redirect(f"https://{ALLOWED_RETURN_HOSTS[0]}/")
     else:
         # Default API-style response
         response = json({"ok": True})
     # Clear cookie by setting expires in the past and empty value
-    expires_dt = datetime(1970, 1, 1, tzinfo=timezone.utc)
-    response.add_cookie(cookie_name, "", expires=expires_dt, max_age=0, **cookie_opts)
+    response.add_cookie(COOKIE_NAME, "", expires=_EXPIRED, max_age=0, **COOKIE_OPTS)
     return response
 
 
 @app.get("/logout")
 async def logout_get(request):
-    db = _require_db()
     session_id = _extract_session_id(request)
+    # Only touch the database when there is a session to delete
     if session_id:
-        delete_session(db, session_id)
-    cookie_name = os.getenv("AUTH_COOKIE_NAME", "ledd_auth")
-    cookie_opts = _cookie_settings()
+        await delete_session(_require_db(), session_id)
     # Choose a safe redirect destination
     target = request.args.get("continue") or request.headers.get("referer")
     if not (isinstance(target, str) and _is_allowed_redirect_url(target)):
-        target = f"https://{_allowed_return_hosts()[0]}/"
+        target = f"https://{ALLOWED_RETURN_HOSTS[0]}/"
     response = redirect(target)
-    expires_dt = datetime(1970, 1, 1, tzinfo=timezone.utc)
-    response.add_cookie(cookie_name, "", expires=expires_dt, max_age=0, **cookie_opts)
+    response.add_cookie(COOKIE_NAME, "", expires=_EXPIRED, max_age=0, **COOKIE_OPTS)
     # Return the redirect response that also clears the cookie
     return response
 
@@ -278,4 +321,6 @@ async def logout_get(request):
 if __name__ == "__main__":
     # This will typically run behind a reverse proxy for auth.ledd.live
     port = int(os.getenv("AUTH_SERVER_PORT", "3100"))
-    app.run(host="0.0.0.0", port=port, auto_reload=True)
+    # ENV=prod: one worker per CPU (fast=True), no access log, no file watcher
+    prod = os.getenv("ENV") == "prod"
+    app.run(host="0.0.0.0", port=port, fast=prod, access_log=not prod, auto_reload=not prod)
@@ -2,24 +2,48 @@ from __future__ import annotations
 
 import aiohttp
 import urllib.parse
-from typing import Dict, Any
+from functools import lru_cache
+from typing import Dict, Any, Optional
 
 
 DISCORD_API = "https://discord.com/api"
 AUTHORIZE_URL = "https://discord.com/oauth2/authorize"
 
+# Shared HTTP session so Discord calls reuse pooled keep-alive connections
+_SESSION: Optional[aiohttp.ClientSession] = None
 
-def build_authorize_url(*, client_id: str, state: str, redirect_uri: str, scope: str) -> str:
-    base = AUTHORIZE_URL
+
+def get_session() -> aiohttp.ClientSession:
+    global _SESSION
+    if _SESSION is None or _SESSION.closed:
+        _SESSION = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=100, ttl_dns_cache=300, keepalive_timeout=60)
+        )
+    return _SESSION
+
+
+async def close_session() -> None:
+    global _SESSION
+    if _SESSION is not None and not _SESSION.closed:
+        await _SESSION.close()
+    _SESSION = None
+
+
+@lru_cache(maxsize=8)
+def _authorize_prefix(client_id: str, redirect_uri: str, scope: str) -> str:
     params = {
         "client_id": client_id,
         "response_type": "code",
         "redirect_uri": redirect_uri,
         "scope": scope,
-        "state": state,
         # optional: prompt=consent to force re-consent
     }
-    return f"{base}?{urllib.parse.urlencode(params)}"
+    return f"{AUTHORIZE_URL}?{urllib.parse.urlencode(params)}&state="
+
+
+def build_authorize_url(*, client_id: str, state: str, redirect_uri: str, scope: str) -> str:
+    # Only the state varies per login; it must already be URL-safe (token_urlsafe)
+    return _authorize_prefix(client_id, redirect_uri, scope) + state
 
 
 async def exchange_code_for_token(*, code: str, client_id: str, client_secret: str, redirect_uri: str) -> Dict[str, Any]:
@@ -32,20 +56,18 @@ async def exchange_code_for_token(*, code: str, client_id: str, client_secret: s
         "redirect_uri": redirect_uri,
     }
     headers = {"Content-Type": "application/x-www-form-urlencoded"}
-    async with aiohttp.ClientSession() as session:
-        async with session.post(token_url, data=data, headers=headers) as resp:
-            if resp.status != 200:
-                text = await resp.text()
-                raise RuntimeError(f"Token exchange failed: {resp.status} {text}")
-            return await resp.json()
+    async with get_session().post(token_url, data=data, headers=headers) as resp:
+        if resp.status != 200:
+            text = await resp.text()
+            raise RuntimeError(f"Token exchange failed: {resp.status} {text}")
+        return await resp.json()
 
 
 async def fetch_discord_user(access_token: str) -> Dict[str, Any]:
     me_url = f"{DISCORD_API}/users/@me"
     headers = {"Authorization": f"Bearer {access_token}"}
-    async with aiohttp.ClientSession() as session:
-        async with session.get(me_url, headers=headers) as resp:
-            if resp.status != 200:
-                text = await resp.text()
-                raise RuntimeError(f"Fetch user failed: {resp.status} {text}")
-            return await resp.json()
+    async with get_session().get(me_url, headers=headers) as resp:
+        if resp.status != 200:
+            text = await resp.text()
+            raise RuntimeError(f"Fetch user failed: {resp.status} {text}")
+        return await resp.json()
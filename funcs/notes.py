@@ -1,7 +1,10 @@
 from __future__ import annotations
 
 from datetime import datetime, timezone
-from typing import Any, Dict, Optional
+from typing import Any, Dict, Iterable, List, Optional
+
+import orjson
+from cachetools import LRUCache
 
 try:
     from bson import ObjectId  # type: ignore
@@ -9,26 +12,33 @@ except Exception:  # pragma: no cover - fallback if bson is unavailable
     class ObjectId:  # pyright: ignore[reportGeneralTypeIssues]
         pass
 
+from funcs.connectDB import ensure_indexes
+
 
 COLLECTION_NAME = "user_notes"
 
+# user_id -> (updated_at, serialized to_api(doc)). updated_at changes on every
+# write, so a version mismatch means the entry is stale.
+NOTE_CACHE: LRUCache = LRUCache(maxsize=1024)
+
 
 def _coll(db):
     return db[COLLECTION_NAME]
 
 
-def create_note_indexes(db) -> bool:
+async def create_note_indexes(db) -> bool:
     try:
-        c = _coll(db)
-        c.create_index([("user_id", 1)], unique=True, name="uniq_user_id")
-        c.create_index([("updated_at", -1)], name="idx_updated_at_desc")
+        await ensure_indexes(_coll(db), [
+            ([("user_id", 1)], {"unique": True, "name": "uniq_user_id"}),
+            ([("updated_at", -1)], {"name": "idx_updated_at_desc"}),
+        ])
         return True
     except Exception as e:
         print(f"Error creating note indexes: {e}")
         return False
 
 
-def set_user_note(db, user_id: int, content: str) -> Dict[str, Any]:
+async def set_user_note(db, user_id: int, content: str) -> Dict[str, Any]:
     now = datetime.now(timezone.utc)
     c = _coll(db)
     if not isinstance(content, str):
@@ -39,17 +49,27 @@ def set_user_note(db, user_id: int, content: str) -> Dict[str, Any]:
         "updated_at": now,
     }
     update = {"$set": note_doc, "$setOnInsert": {"created_at": now}}
-    c.update_one({"user_id": int(user_id)}, update, upsert=True)
-    doc = c.find_one({"user_id": int(user_id)})
+    NOTE_CACHE.pop(int(user_id), None)
+    await c.update_one({"user_id": int(user_id)}, update, upsert=True)
+    doc = await c.find_one({"user_id": int(user_id)})
     return doc  # type: ignore[return-value]
 
 
-def get_user_note(db, user_id: int) -> Optional[Dict[str, Any]]:
-    return _coll(db).find_one({"user_id": int(user_id)})
+async def get_user_note(db, user_id: int) -> Optional[Dict[str, Any]]:
+    return await _coll(db).find_one({"user_id": int(user_id)})
+
 
+async def get_user_notes(db, user_ids: Iterable[int]) -> List[Dict[str, Any]]:
+    # One $in query instead of a round-trip per id; missing notes are skipped
+    ids = [int(u) for u in user_ids]
+    docs = await _coll(db).find({"user_id": {"$in": ids}}).to_list(length=len(ids))
+    by_id = {d["user_id"]: d for d in docs}
+    return [by_id[u] for u in dict.fromkeys(ids) if u in by_id]
 
-def delete_user_note(db, user_id: int) -> bool:
-    res = _coll(db).delete_one({"user_id": int(user_id)})
+
+async def delete_user_note(db, user_id: int) -> bool:
+    NOTE_CACHE.pop(int(user_id), None)
+    res = await _coll(db).delete_one({"user_id": int(user_id)})
     return res.deleted_count > 0
 
 
@@ -63,3 +83,15 @@ def to_api(doc: Dict[str, Any]) -> Dict[str, Any]:
         if isinstance(v, datetime):
             out[k] = v.isoformat()
     return out
+
+
+def note_json(doc: Dict[str, Any]) -> bytes:
+    """Serialized to_api(doc), reused while the note's updated_at is unchanged"""
+    user_id = doc.get("user_id")
+    version = doc.get("updated_at")
+    cached = NOTE_CACHE.get(user_id)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    payload = orjson.dumps(to_api(doc))
+    NOTE_CACHE[user_id] = (version, payload)
+    return payload
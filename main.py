@@ -1,47 +1,146 @@
 from sanic import Sanic
-from sanic.response import json, html
+from sanic.response import json
 from sanic.exceptions import NotFound
-from sanic.response import file
+from sanic.response import raw, HTTPResponse
 from pathlib import Path
 from funcs.connectDB import connect_to_mongodb
 from funcs.notes import (
     create_note_indexes,
     get_user_note,
+    get_user_notes,
     set_user_note,
     delete_user_note,
+    note_json,
     to_api,
 )
 from funcs.auth_store import get_user_by_session
 import os
+import re
+import gzip
+import hashlib
+import orjson
 from urllib.parse import quote
-app = Sanic("Ledd")
+from functools import lru_cache
+from html import escape
+
+try:
+    import brotli  # type: ignore
+except Exception:  # pragma: no cover - optional; gzip is used instead
+    brotli = None
+# orjson serializes every json() response (Sanic accepts bytes from dumps)
+# and parses request.json bodies
+app = Sanic("Ledd", dumps=orjson.dumps, loads=orjson.loads)
+
+
+def _parse_uid(value: str) -> int:
+    # Cast for the "uid" route type; sanic-routing applies the cast (not the
+    # pattern) to plain path segments, and a ValueError makes the route 404
+    if len(value) > 19 or not (value.isascii() and value.isdigit()):
+        raise ValueError(value)
+    return int(value)
+
+
+# Note owner ids: unsigned, at most 19 digits (Discord snowflakes fit in int64)
+app.router.register_pattern("uid", _parse_uid, r"^\d{1,19}$")
 BASE_DIR = Path(__file__).resolve().parent
 PAGES_DIR = BASE_DIR / "pages"
 
 # Shared-session settings (must match auth_server)
 AUTH_COOKIE_NAME = os.getenv("AUTH_COOKIE_NAME", "ledd_auth")
 
+# /ping never changes, so serialize it once
+_PING_BODY = orjson.dumps({"status": "ok"})
+
+# 404 body with only path/method varying; paths needing JSON escapes use json()
+_NOT_FOUND_BODY = b'{"error":"Not Found","path":"%s","method":"%s"}'
+_JSON_UNSAFE_RE = re.compile(r'["\\\x00-\x1f]')
+
+# HTTP cache policies. The home page differs for signed-in users, hence Vary: Cookie.
+_PING_HEADERS = {"Cache-Control": "public, max-age=5"}
+_NO_STORE_HEADERS = {"Cache-Control": "private, no-store"}
+_HOME_ANON_HEADERS = {"Cache-Control": "public, max-age=60", "Vary": "Cookie, Accept-Encoding"}
+_HOME_ANON_HEADERS_BY_ENCODING = {
+    "identity": _HOME_ANON_HEADERS,
+    "gzip": {**_HOME_ANON_HEADERS, "Content-Encoding": "gzip"},
+    "br": {**_HOME_ANON_HEADERS, "Content-Encoding": "br"},
+}
+_HOME_AUTHED_HEADERS = {"Cache-Control": "private, no-store", "Vary": "Cookie"}
+
+# Public origin of this app (e.g. https://dev.ledd.live); when set, login
+# continue URLs skip the forwarded-header inspection.
+PUBLIC_BASE = (os.getenv("PUBLIC_BASE") or "").rstrip("/") or None
+
+def _user_id_out_of_range(user_id: int) -> bool:
+    # Mongo stores int64; non-zero after >> 63 means negative or >= 2**63
+    return bool(user_id >> 63)
+
+
+# Upper bound on ids accepted by POST /notes/batch
+NOTES_BATCH_MAX = 100
+
+# Re-read pages from disk on every request (dev only)
+PAGES_RELOAD = os.getenv("PAGES_RELOAD", "false").lower() == "true"
+
 @app.listener("before_server_start")
 async def setup_db(app, loop):
-    client, db = connect_to_mongodb()
+    client, db = await connect_to_mongodb()
+    # Always bound (None when unavailable) so handlers can read app.ctx.db directly
+    app.ctx.db = db
     if db is not None:
-        create_note_indexes(db)
-        app.ctx.db = db
+        # Build missing indexes in the background so the worker starts serving immediately
+        app.add_task(create_note_indexes(db))
         app.ctx.client = client
         app.ctx.db_ready = True
     else:
         app.ctx.db_ready = False
 
+
+def _load_pages():
+    pages = {}
+    for p in PAGES_DIR.glob("*.html"):
+        data = p.read_bytes()
+        etag = '"' + hashlib.blake2b(data, digest_size=12).hexdigest() + '"'
+        pages[p.stem] = (data, etag)
+    return pages
+
+
+@app.listener("before_server_start")
+async def load_pages(app, loop):
+    # Static pages are tiny; keep them in memory instead of hitting disk per request
+    app.ctx.pages = _load_pages()
+
+
+def _get_page(name: str):
+    if PAGES_RELOAD:
+        app.ctx.pages = _load_pages()
+    return app.ctx.pages.get(name.removesuffix(".html"))
+
+
+def _page_response(request, entry):
+    body, etag = entry
+    headers = {"ETag": etag, "Cache-Control": "public, max-age=300"}
+    inm = request.headers.get("if-none-match")
+    if inm and (inm == etag or etag in (t.strip() for t in inm.split(","))):
+        return HTTPResponse(status=304, headers=headers)
+    return raw(body, content_type="text/html; charset=utf-8", headers=headers)
+
+# Routes that never look at request.ctx.user
+_SKIP_AUTH_PATHS = frozenset(("/ping", "/fmote"))
+_SKIP_AUTH_PREFIXES = ("/pages/",)
+
 # Attach user from session cookie, if present
 @app.middleware("request")
 async def attach_user(request):
-    db = getattr(app.ctx, "db", None)
-    if db is None:
+    path = request.path
+    if path in _SKIP_AUTH_PATHS or path.startswith(_SKIP_AUTH_PREFIXES):
         return
     session_id = request.cookies.get(AUTH_COOKIE_NAME)
     if not session_id:
         return
-    user = get_user_by_session(db, session_id)
+    db = app.ctx.db
+    if db is None:
+        return
+    user = await get_user_by_session(db, session_id)
     if user:
         request.ctx.user = {
             "discord_id": user.get("discord_id"),
@@ -51,153 +150,249 @@ async def attach_user(request):
             "discriminator": user.get("discriminator"),
         }
 
+
+def _encode_slabs(template: str, *slots: str):
+    # Split template around each slot (in order) and UTF-8 encode the static parts
+    parts = []
+    for slot in slots:
+        head, template = template.split(slot)
+        parts.append(head.encode("utf-8"))
+    parts.append(template.encode("utf-8"))
+    return tuple(parts)
+
+
+# Home pages are pre-encoded into UTF-8 slabs around their few dynamic slots, so
+# rendering is byte concatenation. Signed-in slots: {avatar}, {username}.
+HOME_AUTHED_HTML = """\
+<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="utf-8" />
+    <meta name="viewport" content="width=device-width, initial-scale=1" />
+    <title>Welcome • dev.ledd.live</title>
+    <style>
+        :root { --bg:#0b0f16; --text:#e6eefc; --muted:#9bb0c9; --accent:#4da3ff }
+        html, body { height: 100%; }
+        body { margin:0; display:grid; place-items:center; background:var(--bg); color:var(--text); font:16px/1.5 system-ui,-apple-system,Segoe UI,Roboto,Arial,sans-serif; }
+        .card { width:min(680px,92vw); background:#111827; border:1px solid rgba(255,255,255,0.08); border-radius:16px; padding:28px; box-shadow:0 10px 40px rgba(0,0,0,0.35); }
+        .row { display:flex; gap:20px; align-items:center; }
+        .pfp { width:84px; height:84px; border-radius:50%; border:2px solid rgba(255,255,255,0.2); box-shadow:0 6px 20px rgba(0,0,0,0.35); }
+        h1 { margin:0 0 6px; font-size:24px; }
+        p { margin:0; color:var(--muted); }
+        .actions { margin-top:22px; display:flex; gap:12px; }
+        .btn { display:inline-flex; align-items:center; gap:10px; padding:10px 14px; border-radius:10px; border:1px solid rgba(255,255,255,0.1); color:#081220; text-decoration:none; background:linear-gradient(135deg,#4da3ff,#7cc4ff); }
+        .btn:hover { filter:brightness(0.98); }
+    </style>
+</head>
+<body>
+    <main class="card">
+        <div class="row">
+            <img class="pfp" src="{avatar}" alt="avatar"/>
+            <div>
+                <h1>Welcome, {username}</h1>
+                <p>You’re signed in on dev.ledd.live via Discord.</p>
+            </div>
+        </div>
+        <div class="actions">
+            <a class="btn" href="/me">View /me</a>
+            <form method="post" action="https://admin.ledd.live/logout">
+                <button class="btn" type="submit">Logout</button>
+            </form>
+        </div>
+    </main>
+</body>
+</html>
+"""
+HOME_AUTHED_PARTS = _encode_slabs(HOME_AUTHED_HTML, "{avatar}", "{username}")
+
+# Signed-out slot: {login_url}
+HOME_ANON_HTML = """\
+<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="utf-8" />
+    <meta name="viewport" content="width=device-width, initial-scale=1" />
+    <title>dev.ledd.live • Sign in</title>
+    <style>
+        :root { --bg:#0b0f16; --text:#e6eefc; --muted:#9bb0c9; --accent:#4da3ff }
+        html, body { height: 100%; }
+        body { margin:0; display:grid; place-items:center; background:var(--bg); color:var(--text); font:16px/1.5 system-ui,-apple-system,Segoe UI,Roboto,Arial,sans-serif; }
+        .card { width:min(640px,92vw); background:#111827; border-radius:16px; padding:28px; border:1px solid rgba(255,255,255,0.08); box-shadow:0 10px 40px rgba(0,0,0,0.35); }
+        h1 { margin:0 0 10px; font-size:24px; }
+        p { margin:0 0 18px; color:var(--muted); }
+        .btn { display:inline-flex; align-items:center; gap:10px; padding:12px 16px; border-radius:10px; border:1px solid rgba(255,255,255,0.12); color:#081220; text-decoration:none; background:linear-gradient(135deg,#4da3ff,#7cc4ff); }
+        .btn:hover { filter:brightness(0.98); }
+    </style>
+</head>
+<body>
+    <main class="card">
+        <h1>Welcome to dev.ledd.live</h1>
+        <p>Sign in with Discord to continue.</p>
+        <a class="btn" href="{login_url}">Login with Discord</a>
+    </main>
+</body>
+</html>
+"""
+HOME_ANON_PREFIX, HOME_ANON_SUFFIX = _encode_slabs(HOME_ANON_HTML, "{login_url}")
+LOGIN_URL_PREFIX = b"https://admin.ledd.live/discord/login?continue="
+
+# Only well-formed hosts go through the cache so junk Host headers can't churn it
+_CACHEABLE_HOST_RE = re.compile(r"[A-Za-z0-9.\-:]+")
+
+
+def _build_login_url(base: str, path: str) -> bytes:
+    # quote(safe='') leaves only [A-Za-z0-9_.~%-], which is attribute-safe
+    return LOGIN_URL_PREFIX + quote(base + path, safe="").encode("ascii")
+
+
+def _continue_base(request):
+    # Origin the login flow should return to, and whether it is safe to cache on
+    if PUBLIC_BASE:
+        return PUBLIC_BASE, True
+    headers = request.headers
+    scheme = "https" if headers.get("x-forwarded-proto", request.scheme) == "https" else "http"
+    host = headers.get("x-forwarded-host", request.host)
+    return f"{scheme}://{host}", bool(_CACHEABLE_HOST_RE.fullmatch(host))
+
+
+@lru_cache(maxsize=64)
+def _anon_home_variants(base: str, path: str):
+    # Signed-out page per (origin, path), precompressed once per encoding
+    body = HOME_ANON_PREFIX + _build_login_url(base, path) + HOME_ANON_SUFFIX
+    variants = {"gzip": gzip.compress(body, 6), "identity": body}
+    if brotli is not None:
+        variants["br"] = brotli.compress(body, quality=5)
+    return variants
+
+
+def _pick_encoding(request, variants) -> str:
+    accept = request.headers.get("accept-encoding", "")
+    if "br" in variants and "br" in accept:
+        return "br"
+    if "gzip" in accept:
+        return "gzip"
+    return "identity"
+
+
+DEFAULT_AVATARS = tuple(f"https://cdn.discordapp.com/embed/avatars/{i}.png" for i in range(5))
+
+
+@lru_cache(maxsize=16)
+def _default_avatar(discrim) -> str:
+    # Discord dropped discriminators, so "0"/missing is the common case
+    if not discrim or discrim == "0":
+        return DEFAULT_AVATARS[0]
+    # isdecimal() (not isdigit()) guarantees int() accepts the string
+    return DEFAULT_AVATARS[int(discrim) % 5 if discrim.isdecimal() else 0]
+
+
+def _avatar_url(did, ava, discrim):
+    if did and ava:
+        return f"https://cdn.discordapp.com/avatars/{did}/{ava}.png?size=128"
+    return _default_avatar(discrim)
+
+
 @app.route("/")
 async def home(request):
         user = getattr(request.ctx, "user", None)
 
-        # Build continue URL back to this page
-        scheme = "https" if request.headers.get("x-forwarded-proto", request.scheme) == "https" else "http"
-        host = request.headers.get("x-forwarded-host", request.host)
-        continue_url = f"{scheme}://{host}{request.path}"
-        login_url = f"https://admin.ledd.live/discord/login?continue={quote(continue_url, safe='')}"
-
-        def avatar_url(u):
-                did = u.get("discord_id")
-                ava = u.get("avatar")
-                discrim = u.get("discriminator") or "0"
-                if did and ava:
-                        return f"https://cdn.discordapp.com/avatars/{did}/{ava}.png?size=128"
-                try:
-                        idx = int(discrim) % 5
-                except Exception:
-                        idx = 0
-                return f"https://cdn.discordapp.com/embed/avatars/{idx}.png"
-
         if user:
-                avatar = avatar_url(user)
+                avatar = _avatar_url(user.get("discord_id"), user.get("avatar"), user.get("discriminator"))
                 username = user.get("global_name") or user.get("username") or "User"
-                body = f"""
-                <!DOCTYPE html>
-                <html lang=\"en\">
-                <head>
-                    <meta charset=\"utf-8\" />
-                    <meta name=\"viewport\" content=\"width=device-width, initial-scale=1\" />
-                    <title>Welcome • dev.ledd.live</title>
-                    <style>
-                        :root {{ --bg:#0b0f16; --text:#e6eefc; --muted:#9bb0c9; --accent:#4da3ff }}
-                        html, body {{ height: 100%; }}
-                        body {{ margin:0; display:grid; place-items:center; background:var(--bg); color:var(--text); font:16px/1.5 system-ui,-apple-system,Segoe UI,Roboto,Arial,sans-serif; }}
-                        .card {{ width:min(680px,92vw); background:#111827; border:1px solid rgba(255,255,255,0.08); border-radius:16px; padding:28px; box-shadow:0 10px 40px rgba(0,0,0,0.35); }}
-                        .row {{ display:flex; gap:20px; align-items:center; }}
-                        .pfp {{ width:84px; height:84px; border-radius:50%; border:2px solid rgba(255,255,255,0.2); box-shadow:0 6px 20px rgba(0,0,0,0.35); }}
-                        h1 {{ margin:0 0 6px; font-size:24px; }}
-                        p {{ margin:0; color:var(--muted); }}
-                        .actions {{ margin-top:22px; display:flex; gap:12px; }}
-                        .btn {{ display:inline-flex; align-items:center; gap:10px; padding:10px 14px; border-radius:10px; border:1px solid rgba(255,255,255,0.1); color:#081220; text-decoration:none; background:linear-gradient(135deg,#4da3ff,#7cc4ff); }}
-                        .btn:hover {{ filter:brightness(0.98); }}
-                    </style>
-                </head>
-                <body>
-                    <main class=\"card\">
-                        <div class=\"row\">
-                            <img class=\"pfp\" src=\"{avatar}\" alt=\"avatar\"/>
-                            <div>
-                                <h1>Welcome, {username}</h1>
-                                <p>You’re signed in on dev.ledd.live via Discord.</p>
-                            </div>
-                        </div>
-                        <div class=\"actions\">
-                            <a class=\"btn\" href=\"/me\">View /me</a>
-                            <form method=\"post\" action=\"https://admin.ledd.live/logout\">
-                                <button class=\"btn\" type=\"submit\">Logout</button>
-                            </form>
-                        </div>
-                    </main>
-                </body>
-                </html>
-                """
-                return html(body)
+                head, middle, tail = HOME_AUTHED_PARTS
+                payload = b"".join((
+                    head, escape(avatar).encode("utf-8"), middle, escape(username).encode("utf-8"), tail,
+                ))
+                return raw(payload, content_type="text/html; charset=utf-8", headers=_HOME_AUTHED_HEADERS)
 
         # Not authenticated → show login CTA
-        body = f"""
-        <!DOCTYPE html>
-        <html lang=\"en\">
-        <head>
-            <meta charset=\"utf-8\" />
-            <meta name=\"viewport\" content=\"width=device-width, initial-scale=1\" />
-            <title>dev.ledd.live • Sign in</title>
-            <style>
-                :root {{ --bg:#0b0f16; --text:#e6eefc; --muted:#9bb0c9; --accent:#4da3ff }}
-                html, body {{ height: 100%; }}
-                body {{ margin:0; display:grid; place-items:center; background:var(--bg); color:var(--text); font:16px/1.5 system-ui,-apple-system,Segoe UI,Roboto,Arial,sans-serif; }}
-                .card {{ width:min(640px,92vw); background:#111827; border-radius:16px; padding:28px; border:1px solid rgba(255,255,255,0.08); box-shadow:0 10px 40px rgba(0,0,0,0.35); }}
-                h1 {{ margin:0 0 10px; font-size:24px; }}
-                p {{ margin:0 0 18px; color:var(--muted); }}
-                .btn {{ display:inline-flex; align-items:center; gap:10px; padding:12px 16px; border-radius:10px; border:1px solid rgba(255,255,255,0.12); color:#081220; text-decoration:none; background:linear-gradient(135deg,#4da3ff,#7cc4ff); }}
-                .btn:hover {{ filter:brightness(0.98); }}
-            </style>
-        </head>
-        <body>
-            <main class=\"card\">
-                <h1>Welcome to dev.ledd.live</h1>
-                <p>Sign in with Discord to continue.</p>
-                <a class=\"btn\" href=\"{login_url}\">Login with Discord</a>
-            </main>
-        </body>
-        </html>
-        """
-        return html(body)
-
-
-
-@app.route("/ping")
+        base, cacheable = _continue_base(request)
+        if not cacheable:
+            payload = HOME_ANON_PREFIX + _build_login_url(base, request.path) + HOME_ANON_SUFFIX
+            return raw(payload, content_type="text/html; charset=utf-8", headers=_HOME_ANON_HEADERS)
+        variants = _anon_home_variants(base, request.path)
+        encoding = _pick_encoding(request, variants)
+        return raw(
+            variants[encoding],
+            content_type="text/html; charset=utf-8",
+            headers=_HOME_ANON_HEADERS_BY_ENCODING[encoding],
+        )
+
+
+
+@app.route("/ping", methods=["GET", "HEAD"])
 async def ping(request):
-    return json({"status": "ok"})
+    return raw(_PING_BODY, content_type="application/json", headers=_PING_HEADERS)
 
 @app.get("/me")
 async def whoami(request):
     user = getattr(request.ctx, "user", None)
     if not user:
-        return json({"authenticated": False}, status=401)
-    return json({"authenticated": True, "user": user})
+        return json({"authenticated": False}, status=401, headers=_NO_STORE_HEADERS)
+    return json({"authenticated": True, "user": user}, headers=_NO_STORE_HEADERS)
 
-@app.get("/<user_id:int>/note")
+@app.get("/<user_id:uid>/note")
 async def note_get(request, user_id: int):
-    db = getattr(app.ctx, "db", None)
+    if _user_id_out_of_range(user_id):
+        return json({"error": "user_id out of range", "user_id": user_id}, status=400)
+    db = app.ctx.db
     if db is None:
         return json({"error": "Database not available"}, status=503)
-    doc = get_user_note(db, user_id)
+    doc = await get_user_note(db, user_id)
     if not doc:
         return json({"error": "Note not found", "user_id": user_id}, status=404)
-    return json(to_api(doc))
+    return raw(note_json(doc), content_type="application/json")
 
 
-@app.put("/<user_id:int>/note")
+@app.put("/<user_id:uid>/note")
 async def note_put(request, user_id: int):
-    db = getattr(app.ctx, "db", None)
+    if _user_id_out_of_range(user_id):
+        return json({"error": "user_id out of range", "user_id": user_id}, status=400)
+    db = app.ctx.db
     if db is None:
         return json({"error": "Database not available"}, status=503)
     body = request.json or {}
     content = body.get("content")
     if content is None:
         return json({"error": "'content' is required in body"}, status=400)
-    doc = set_user_note(db, user_id, content)
-    return json(to_api(doc), status=200)
+    doc = await set_user_note(db, user_id, content)
+    return raw(note_json(doc), status=200, content_type="application/json")
 
 
-@app.delete("/<user_id:int>/note")
+@app.delete("/<user_id:uid>/note")
 async def note_delete(request, user_id: int):
-    db = getattr(app.ctx, "db", None)
+    if _user_id_out_of_range(user_id):
+        return json({"error": "user_id out of range", "user_id": user_id}, status=400)
+    db = app.ctx.db
     if db is None:
         return json({"error": "Database not available"}, status=503)
-    ok = delete_user_note(db, user_id)
+    ok = await delete_user_note(db, user_id)
     if not ok:
         return json({"deleted": False, "user_id": user_id}, status=404)
     return json({"deleted": True, "user_id": user_id})
 
+
+@app.post("/notes/batch")
+async def notes_batch(request):
+    db = app.ctx.db
+    if db is None:
+        return json({"error": "Database not available"}, status=503)
+    body = request.json
+    user_ids = body.get("user_ids") if isinstance(body, dict) else None
+    if not isinstance(user_ids, list) or not all(type(u) is int and not _user_id_out_of_range(u) for u in user_ids):
+        return json({"error": "'user_ids' must be a list of non-negative 64-bit integers"}, status=400)
+    if len(user_ids) > NOTES_BATCH_MAX:
+        return json({"error": f"At most {NOTES_BATCH_MAX} user_ids per request"}, status=400)
+    docs = await get_user_notes(db, user_ids)
+    return json([to_api(d) for d in docs])
+
 ## handle 404
 @app.exception(NotFound)
 async def handle_404(request, exc):
+    path = request.path
+    if not _JSON_UNSAFE_RE.search(path):
+        body = _NOT_FOUND_BODY % (path.encode("utf-8"), request.method.encode("ascii"))
+        return raw(body, status=404, content_type="application/json")
     return json({
         "error": "Not Found",
         "path": request.path,
@@ -207,23 +402,23 @@ async def handle_404(request, exc):
 # Serve static HTML pages from /pages/<filename>
 @app.get("/pages/<name:str>")
 async def serve_page(request, name: str):
-    candidate = PAGES_DIR / name
-    if candidate.suffix == "":
-        candidate = candidate.with_suffix(".html")
-    if candidate.is_file():
-        return await file(candidate)
+    entry = _get_page(name)
+    if entry is not None:
+        return _page_response(request, entry)
     raise NotFound(f"Page not found: {name}")
 
 # Direct route alias for /fmote
 @app.get("/fmote")
 async def fmote(request):
-    candidate = PAGES_DIR / "fmote.html"
-    if candidate.is_file():
-        return await file(candidate)
+    entry = _get_page("fmote")
+    if entry is not None:
+        return _page_response(request, entry)
     raise NotFound("fmote page not found")
 
 if __name__ == "__main__":
-    # Enable auto-reload so changes to this file (like adding routes) restart the server automatically
-    app.run(host="0.0.0.0", port=3000, auto_reload=True)
+    # ENV=prod: one worker per CPU (fast=True), no access log, no file watcher.
+    # Otherwise auto-reload so changes to this file (like adding routes) restart the server automatically
+    prod = os.getenv("ENV") == "prod"
+    app.run(host="0.0.0.0", port=3000, fast=prod, access_log=not prod, auto_reload=not prod)
     
 